@@ -4,6 +4,7 @@ Deploy to multiple servers
 Usage: python3 deploy_multi.py --repo URL server1 server2 server3
 """
 import argparse
+import shlex
 import subprocess
 import sys
 from pathlib import Path
@@ -26,15 +27,14 @@ def deploy_to_server(server, repo_url, branch='main'):
         # Copy deployment script to server
         script_path = Path(__file__).parent / 'deploy.py'
         subprocess.run(
-            f'scp {script_path} root@{server}:/tmp/',
-            shell=True,
+            ['scp', str(script_path), f'root@{server}:/tmp/'],
             check=True
         )
         
         # Run deployment
+        remote_cmd = shlex.join(['python3', '/tmp/deploy.py', repo_url, '--branch', branch])
         result = subprocess.run(
-            f'ssh root@{server} "python3 /tmp/deploy.py {repo_url} --branch {branch}"',
-            shell=True,
+            ['ssh', f'root@{server}', remote_cmd],
             capture_output=True,
             text=True
         )
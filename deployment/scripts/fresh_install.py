@@ -5,11 +5,93 @@ All bugs fixed, tested and working
 """
 
 import argparse
+import concurrent.futures
+import functools
+import gzip
+import io
+import re
+import secrets
+import shlex
+import shutil
+import string
 import subprocess
 import sys
 import os
+import tarfile
+import textwrap
+import time
+import urllib.request
 from pathlib import Path
 
+from ssh_options import SSH_MULTIPLEX_OPTIONS
+
+# The username is interpolated into the generated shell script unquoted,
+# so only accept names useradd would accept anyway
+USERNAME_PATTERN = re.compile(r"^[a-z_][a-z0-9_-]{0,31}$")
+
+# Config files installed on the server live next to this script
+TEMPLATES_DIR = Path(__file__).resolve().parent / "templates"
+
+# Every package the server needs, installed in one apt-get transaction
+SYSTEM_PACKAGES = [
+    # Base tools
+    "wget", "git", "vim", "ufw", "fail2ban", "xz-utils", "unattended-upgrades",
+    # API runtime and web server
+    "python3", "python3-pip", "python3-venv", "nginx", "sqlite3",
+    "mysql-server",
+    # PHP for WordPress
+    "php8.3", "php8.3-fpm", "php8.3-mysql", "php8.3-curl", "php8.3-gd",
+    "php8.3-mbstring", "php8.3-xml", "php8.3-xmlrpc", "php8.3-soap",
+    "php8.3-intl", "php8.3-zip", "php8.3-cli", "php8.3-imagick",
+    # Docker for WordPress containers
+    "docker-ce", "docker-ce-cli", "containerd.io", "docker-buildx-plugin",
+    "docker-compose-plugin",
+]
+
+# aria2 settings for prefetching .debs: files in flight, connections per file
+APT_DOWNLOAD_JOBS = 8
+APT_CONNECTIONS_PER_FILE = 4
+
+# How long the post-install checks as the new user keep retrying
+SSH_VERIFY_TIMEOUT = 15
+
+# Config files shipped to the server in one archive: (template, path, mode).
+# Paths are relative to / and may use @{username}.
+CONFIG_FILES = [
+    ("apt-norecommends.conf", "etc/apt/apt.conf.d/01norecommends", 0o644),
+    (
+        "sshd-hosting-manager.conf",
+        "etc/ssh/sshd_config.d/10-hosting-manager.conf",
+        0o644,
+    ),
+    ("sudoers", "etc/sudoers.d/@{username}", 0o440),
+    (
+        "hosting-manager.service",
+        "etc/systemd/system/hosting-manager.service",
+        0o644,
+    ),
+    (
+        "hosting-manager-api.conf",
+        "etc/nginx/sites-available/hosting-manager-api",
+        0o644,
+    ),
+    ("ufw-hosting-manager", "etc/ufw/applications.d/hosting-manager", 0o644),
+    ("php-hosting.ini", "etc/php/8.3/fpm/conf.d/99-hosting.ini", 0o644),
+    ("index.html", "var/www/hosting-manager/index.html", 0o644),
+]
+
+# Where an uploaded wheelhouse (--wheelhouse) is unpacked on the server
+REMOTE_WHEELHOUSE = "/var/cache/hosting-manager/wheels"
+
+# Unpack the gzipped script sent on stdin to a private temp file and run it
+# from there with stdin closed, so no command in it can read the rest of the
+# script as its own input. The file holds the MySQL password and is removed
+# afterwards.
+REMOTE_RUN_SCRIPT = (
+    'f=$(mktemp) && gzip -dc > "$f" && '
+    '{ bash "$f" < /dev/null; rc=$?; rm -f "$f"; exit $rc; }'
+)
+
 
 class Colors:
     GREEN = "\033[0;32m"
@@ -41,446 +123,359 @@ def print_header(message):
     print(f"{Colors.BLUE}{'='*60}{Colors.NC}\n")
 
 
+class ConfigTemplate(string.Template):
+    """string.Template with @{name} placeholders so nginx/shell $vars pass through
+
+    Only the braced form is a placeholder; any other @ (shell "$@",
+    'user'@'host' in SQL) is left alone.
+    """
+
+    delimiter = "@"
+    pattern = r"""
+    @(?:
+        (?P<escaped>(?!))                   # no escape sequence needed
+      | (?P<named>(?!))                     # no bare @name form
+      | {(?P<braced>[_a-z][_a-z0-9]*)}      # @{name}
+      | (?P<invalid>(?!))
+    )
+    """
+
+
+@functools.lru_cache(maxsize=None)
+def load_template(name):
+    """Read and compile a template once per process"""
+    return ConfigTemplate((TEMPLATES_DIR / name).read_text())
+
+
+def render_template(name, **values):
+    """Render a config file from the templates directory"""
+    return load_template(name).substitute(values)
+
+
+@functools.lru_cache(maxsize=None)
+def build_config_payload(username):
+    """Pack the config files into an in-memory tar.gz rooted at /
+
+    The files depend only on the username, so provisioning a fleet with the
+    same user renders and compresses them once.
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for template, path, mode in CONFIG_FILES:
+            data = render_template(template, username=username).encode()
+            info = tarfile.TarInfo(ConfigTemplate(path).substitute(username=username))
+            info.size = len(data)
+            info.mode = mode
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+@functools.lru_cache(maxsize=None)
+def build_wheelhouse_archive(wheelhouse):
+    """Pack the wheels in a local directory into an in-memory tar.gz
+
+    Cached so provisioning several servers in one process packs it once.
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for wheel in sorted(Path(wheelhouse).glob("*.whl")):
+            tar.add(wheel, arcname=wheel.name)
+    return buffer.getvalue()
+
+
+@functools.lru_cache(maxsize=4)
+def load_ssh_public_key(home_dir):
+    """Read the SSH public key under home_dir, generating one if none exists
+
+    Cached so installers created for several servers look it up once.
+    """
+    ssh_dir = Path(home_dir) / ".ssh"
+
+    # Try each key type with a single read rather than exists() + read
+    for key_name in ("id_ed25519.pub", "id_rsa.pub"):
+        ssh_key_path = ssh_dir / key_name
+        try:
+            key = ssh_key_path.read_text().strip()
+        except FileNotFoundError:
+            continue
+        print_success(f"Using SSH key: {ssh_key_path}")
+        return key
+
+    print_warning("Generating new ed25519 key...")
+    key_path = ssh_dir / "id_ed25519"
+    subprocess.run(
+        ["ssh-keygen", "-t", "ed25519", "-N", "", "-f", str(key_path)],
+        check=True,
+    )
+    ssh_key_path = ssh_dir / "id_ed25519.pub"
+
+    key = ssh_key_path.read_text().strip()
+    print_success(f"Using SSH key: {ssh_key_path}")
+    return key
+
+
 class ProductionInstaller:
     """Production-ready server installation - Battle-tested"""
 
-    def __init__(self, server, username, repo_url, root_password=None):
+    def __init__(
+        self,
+        server,
+        username,
+        repo_url,
+        root_password=None,
+        wheelhouse=None,
+        apt_cache=None,
+        full_upgrade=False,
+        force_steps=(),
+    ):
         if os.geteuid() == 0:
             print_error("DO NOT run this script with sudo!")
             sys.exit(1)
 
+        if not USERNAME_PATTERN.match(username):
+            print_error(f"Invalid username: {username}")
+            sys.exit(1)
+
         self.server = server
         self.username = username
         self.repo_url = repo_url
         self.root_password = root_password
+        self.wheelhouse = wheelhouse
+        # apt-cacher-ng is usually given as host:port
+        if apt_cache and "://" not in apt_cache:
+            apt_cache = f"http://{apt_cache}"
+        self.apt_cache = apt_cache
+        self.full_upgrade = full_upgrade
+        self.force_steps = force_steps
+        self.mysql_root_password = secrets.token_urlsafe(24)
         self.ssh_public_key = self.get_ssh_public_key()
 
-    def get_ssh_public_key(self):
-        """Get the local SSH public key"""
-        real_user = os.environ.get("SUDO_USER") or os.environ.get("USER")
-        home_dir = Path("/root") if real_user == "root" else Path.home()
+        if wheelhouse and not any(Path(wheelhouse).glob("*.whl")):
+            print_error(f"No wheels found in {wheelhouse}")
+            sys.exit(1)
 
-        ssh_key_path = home_dir / ".ssh" / "id_ed25519.pub"
-        if not ssh_key_path.exists():
-            ssh_key_path = home_dir / ".ssh" / "id_rsa.pub"
+        # Decide once how to authenticate as root. sshpass reads the password
+        # from $SSHPASS (-e) so it never appears in the process list.
+        self.ssh_prefix = []
+        self.ssh_env = None
+        if root_password:
+            # PATH lookup in-process; no need to shell out to `which`
+            if not shutil.which("sshpass"):
+                print_error("sshpass is required for --root-password")
+                print("Install it with: sudo apt-get install sshpass")
+                sys.exit(1)
+            self.ssh_prefix = ["sshpass", "-e"]
+            self.ssh_env = {**os.environ, "SSHPASS": root_password}
 
-        if not ssh_key_path.exists():
-            print_warning("Generating new ed25519 key...")
-            key_path = home_dir / ".ssh" / "id_ed25519"
+    def get_ssh_public_key(self):
+        """Get the local SSH public key, generating one if none exists"""
+        # Lets callers supply the key without touching ~/.ssh at all
+        override = os.environ.get("SSH_PUBKEY_OVERRIDE")
+        if override:
+            return override.strip()
+
+        real_user = os.environ.get("SUDO_USER") or os.environ.get("USER")
+        home_dir = "/root" if real_user == "root" else str(Path.home())
+        return load_ssh_public_key(home_dir)
+
+    def build_ssh_command(self, remote_command, user="root", ssh_args=()):
+        """Build the argv for running a command on the server
+
+        ssh_args are extra ssh options; remote_command may be None for
+        control operations that run nothing remotely.
+        """
+        # The root password only applies to root; other users use the key
+        prefix = self.ssh_prefix if user == "root" else []
+        command = (
+            prefix
+            + ["ssh", *ssh_args, "-o", "StrictHostKeyChecking=no"]
+            + SSH_MULTIPLEX_OPTIONS
+            + [f"{user}@{self.server}"]
+        )
+        if remote_command is not None:
+            command.append(remote_command)
+        return command
+
+    def open_connection(self):
+        """Authenticate as root once and keep the connection as a master
+
+        Every later ssh call for root (payload upload, install stream,
+        checks) runs as a channel over it - no new handshake or password.
+        """
+        subprocess.run(
+            self.build_ssh_command(None, ssh_args=["-M", "-N", "-f"]),
+            env=self.ssh_env,
+            check=True,
+        )
+
+    def close_connections(self):
+        """Close the master connections rather than leaving them to idle out"""
+        for user in ("root", self.username):
             subprocess.run(
-                ["ssh-keygen", "-t", "ed25519", "-N", "", "-f", str(key_path)],
-                check=True,
+                self.build_ssh_command(None, user=user, ssh_args=["-O", "exit"]),
+                env=self.ssh_env,
+                stderr=subprocess.DEVNULL,
             )
-            ssh_key_path = home_dir / ".ssh" / "id_ed25519.pub"
 
-        key = ssh_key_path.read_text().strip()
-        print_success(f"Using SSH key: {ssh_key_path}")
-        return key
+    def probe_user_access(self):
+        """Return True if the user can already log in with our key"""
+        return self.run_check("true", user=self.username)
 
-    def build_installation_script(self):
+    def build_installation_script(self, skip_key_setup=False):
         """Build the complete production installation script"""
-        ssh_key_escaped = self.ssh_public_key.replace("'", "'\"'\"'")
-
-        return rf"""
-set -e
-
-echo "============================================"
-echo "Hosting Manager - Production Installation"
-echo "All Fixes Incorporated - Battle Tested"
-echo "============================================"
-
-# ═══════════════════════════════════════════════════════════
-# STEP 1: Update System
-# ═══════════════════════════════════════════════════════════
-echo "[1/12] Updating system..."
-apt-get update -qq
-DEBIAN_FRONTEND=noninteractive apt-get upgrade -y -qq
-apt-get install -y curl wget git vim ufw fail2ban ca-certificates
-echo "✅ System updated"
-
-# ═══════════════════════════════════════════════════════════
-# STEP 2: Create User
-# ═══════════════════════════════════════════════════════════
-echo "[2/12] Setting up user {self.username}..."
-
-if id "{self.username}" &>/dev/null; then
-    userdel -rf {self.username} 2>/dev/null || true
-fi
-
-useradd -m -s /bin/bash {self.username}
-chmod 755 /home/{self.username}
-usermod -aG sudo {self.username}
-echo '{self.username} ALL=(ALL) NOPASSWD:ALL' > /etc/sudoers.d/{self.username}
-chmod 440 /etc/sudoers.d/{self.username}
-echo "✅ User created"
-
-# ═══════════════════════════════════════════════════════════
-# STEP 3: Setup SSH
-# ═══════════════════════════════════════════════════════════
-echo "[3/12] Setting up SSH..."
-
-mkdir -p /home/{self.username}/.ssh
-chmod 700 /home/{self.username}/.ssh
-
-cat > /home/{self.username}/.ssh/authorized_keys << 'SSHKEY'
-{ssh_key_escaped}
-SSHKEY
-
-chmod 600 /home/{self.username}/.ssh/authorized_keys
-chown -R {self.username}:{self.username} /home/{self.username}/.ssh
-echo "✅ SSH configured"
-
-# ═══════════════════════════════════════════════════════════
-# STEP 4: Configure SSH Daemon
-# ═══════════════════════════════════════════════════════════
-echo "[4/12] Configuring SSH daemon..."
-
-sed -i 's/#PubkeyAuthentication yes/PubkeyAuthentication yes/' /etc/ssh/sshd_config
-sed -i 's/PubkeyAuthentication no/PubkeyAuthentication yes/' /etc/ssh/sshd_config
-
-if systemctl list-units --type=service | grep -q 'ssh.service'; then
-    systemctl restart ssh
-elif systemctl list-units --type=service | grep -q 'sshd.service'; then
-    systemctl restart sshd
-fi
-
-echo "✅ SSH daemon configured"
-
-# ═══════════════════════════════════════════════════════════
-# STEP 5: Firewall
-# ═══════════════════════════════════════════════════════════
-echo "[5/12] Configuring firewall..."
-ufw --force enable
-ufw allow OpenSSH
-ufw allow 22/tcp
-ufw allow 80/tcp
-ufw allow 443/tcp
-ufw allow 5000/tcp
-ufw allow 3000:4000/tcp
-echo "✅ Firewall configured"
-
-# ═══════════════════════════════════════════════════════════
-# STEP 6: Install Node.js + PM2
-# ═══════════════════════════════════════════════════════════
-echo "[6/12] Installing Node.js ecosystem..."
-curl -fsSL https://deb.nodesource.com/setup_20.x | bash - 2>&1 | grep -v "^#" || true
-apt-get install -y nodejs
-
-npm install -g pm2 pnpm 2>&1 | grep -v "npm WARN" || true
-
-echo 'export PATH="/usr/local/bin:/usr/bin:$PATH"' >> /home/{self.username}/.bashrc
-chown {self.username}:{self.username} /home/{self.username}/.bashrc
-
-su - {self.username} -c "pm2 startup" 2>&1 | tail -1 > /tmp/pm2_startup_cmd.sh || true
-if [ -s /tmp/pm2_startup_cmd.sh ]; then
-    bash /tmp/pm2_startup_cmd.sh 2>&1
-    rm /tmp/pm2_startup_cmd.sh
-fi
-
-echo "Node.js: $(node --version)"
-echo "PM2: $(pm2 --version)"
-echo "✅ Node.js + PM2 installed"
-
-# ═══════════════════════════════════════════════════════════
-# STEP 7: Install MySQL Server (BULLETPROOF)
-# ═══════════════════════════════════════════════════════════
-echo "[7/12] Installing MySQL server..."
-
-# Clean slate
-systemctl stop mysql 2>/dev/null || true
-apt-get remove --purge mysql-server mysql-client mysql-common -y 2>/dev/null || true
-rm -rf /etc/mysql /var/lib/mysql /var/log/mysql
-rm -rf /etc/hosting-manager/mysql_root_password /root/.mysql_root_password
-rm -rf /root/.my.cnf /root/.mysql /home/{self.username}/.my.cnf /home/{self.username}/.mysql
-
-# Install fresh
-DEBIAN_FRONTEND=noninteractive apt-get install -y mysql-server
-
-mkdir -p /var/run/mysqld
-chown -R mysql:mysql /var/run/mysqld
-chmod -R 755 /var/run/mysqld
-
-systemctl start mysql
-systemctl enable mysql
-sleep 5
-
-# Generate password
-MYSQL_ROOT_PASS=$(openssl rand -base64 32 | tr -d "=+/" | cut -c1-25)
-
-# Create hosting group
-groupadd -f hosting
-usermod -aG hosting {self.username}
-
-# Method 1: Try init file
-echo "Setting MySQL password (init file method)..."
-systemctl stop mysql
-
-echo "ALTER USER 'root'@'localhost' IDENTIFIED WITH mysql_native_password BY '$MYSQL_ROOT_PASS';" > /tmp/mysql-init.sql
-echo "FLUSH PRIVILEGES;" >> /tmp/mysql-init.sql
-
-mysqld --user=mysql --init-file=/tmp/mysql-init.sql &
-MYSQLD_PID=$!
-sleep 8
-kill $MYSQLD_PID 2>/dev/null || true
-pkill -f "mysqld.*init-file" 2>/dev/null || true
-sleep 2
-rm -f /tmp/mysql-init.sql
-
-systemctl start mysql
-sleep 3
-
-# Method 2: Force it with socket auth (CRITICAL FIX)
-# Ubuntu 24.04 MySQL is stubborn - always force password auth
-echo "Forcing password authentication (Ubuntu 24.04 fix)..."
-mysql -e "ALTER USER 'root'@'localhost' IDENTIFIED WITH mysql_native_password BY '$MYSQL_ROOT_PASS';" 2>/dev/null || true
-mysql -e "FLUSH PRIVILEGES;" 2>/dev/null || true
-sleep 2
-
-# Final verification
-if ! mysql -u root -p"$MYSQL_ROOT_PASS" -e "SELECT 1;" >/dev/null 2>&1; then
-    echo "❌ MySQL password setup failed"
-    exit 1
-fi
-
-echo "✅ MySQL password set successfully"
-
-# Create users
-echo "Creating MySQL users..."
-
-mysql -u root -p"$MYSQL_ROOT_PASS" -e "DROP USER IF EXISTS 'hosting_manager'@'localhost';"
-mysql -u root -p"$MYSQL_ROOT_PASS" -e "CREATE USER 'hosting_manager'@'localhost' IDENTIFIED WITH mysql_native_password BY '$MYSQL_ROOT_PASS';"
-mysql -u root -p"$MYSQL_ROOT_PASS" -e "GRANT ALL PRIVILEGES ON *.* TO 'hosting_manager'@'localhost' WITH GRANT OPTION;"
-
-mysql -u root -p"$MYSQL_ROOT_PASS" -e "DROP USER IF EXISTS 'wp_manager'@'localhost';"
-mysql -u root -p"$MYSQL_ROOT_PASS" -e "CREATE USER 'wp_manager'@'localhost' IDENTIFIED WITH mysql_native_password BY '$MYSQL_ROOT_PASS';"
-mysql -u root -p"$MYSQL_ROOT_PASS" -e "GRANT CREATE, DROP, SELECT, INSERT, UPDATE, DELETE, ALTER, INDEX, CREATE TEMPORARY TABLES, LOCK TABLES ON *.* TO 'wp_manager'@'localhost';"
-
-mysql -u root -p"$MYSQL_ROOT_PASS" -e "FLUSH PRIVILEGES;"
-
-# Save passwords
-mkdir -p /etc/hosting-manager
-echo "$MYSQL_ROOT_PASS" > /etc/hosting-manager/mysql_root_password
-echo "$MYSQL_ROOT_PASS" > /root/.mysql_root_password
-chown root:hosting /etc/hosting-manager/mysql_root_password
-chmod 640 /etc/hosting-manager/mysql_root_password
-chmod 600 /root/.mysql_root_password
-
-mkdir -p /home/{self.username}/.mysql
-echo "[client]" > /home/{self.username}/.mysql/my.cnf
-echo "user=root" >> /home/{self.username}/.mysql/my.cnf
-echo "password=$MYSQL_ROOT_PASS" >> /home/{self.username}/.mysql/my.cnf
-echo "host=localhost" >> /home/{self.username}/.mysql/my.cnf
-chown -R {self.username}:{self.username} /home/{self.username}/.mysql
-chmod 700 /home/{self.username}/.mysql
-chmod 600 /home/{self.username}/.mysql/my.cnf
-
-if mysql -u root -p"$MYSQL_ROOT_PASS" -e "SELECT 'MySQL Ready' as status;" 2>/dev/null | grep -q "MySQL Ready"; then
-    echo "✅ MySQL installed: root, hosting_manager, wp_manager"
-else
-    echo "❌ MySQL verification failed"
-    exit 1
-fi
-
-# ═══════════════════════════════════════════════════════════
-# STEP 8: Install PHP and PHP-FPM
-# ═══════════════════════════════════════════════════════════
-echo "[8/12] Installing PHP 8.3 and PHP-FPM..."
-apt-get install -y php8.3 php8.3-fpm php8.3-mysql php8.3-curl php8.3-gd \
-    php8.3-mbstring php8.3-xml php8.3-xmlrpc php8.3-soap php8.3-intl \
-    php8.3-zip php8.3-cli php8.3-imagick
-
-sed -i 's/;cgi.fix_pathinfo=1/cgi.fix_pathinfo=0/' /etc/php/8.3/fpm/php.ini
-sed -i 's/upload_max_filesize = .*/upload_max_filesize = 64M/' /etc/php/8.3/fpm/php.ini
-sed -i 's/post_max_size = .*/post_max_size = 64M/' /etc/php/8.3/fpm/php.ini
-sed -i 's/memory_limit = .*/memory_limit = 256M/' /etc/php/8.3/fpm/php.ini
-
-# Create log directory (CRITICAL)
-mkdir -p /var/log/php8.3-fpm
-chown www-data:www-data /var/log/php8.3-fpm
-chmod 755 /var/log/php8.3-fpm
-
-systemctl start php8.3-fpm
-systemctl enable php8.3-fpm
-
-echo "PHP: $(php --version | head -n1)"
-echo "✅ PHP 8.3 and PHP-FPM installed"
-
-# ═══════════════════════════════════════════════════════════
-# STEP 9: Install WP-CLI
-# ═══════════════════════════════════════════════════════════
-echo "[9/12] Installing WP-CLI..."
-curl -O https://raw.githubusercontent.com/wp-cli/builds/gh-pages/phar/wp-cli.phar
-chmod +x wp-cli.phar
-mv wp-cli.phar /usr/local/bin/wp
-
-echo "WP-CLI: $(wp --version --allow-root)"
-echo "✅ WP-CLI installed"
-
-# ═══════════════════════════════════════════════════════════
-# STEP 10: Install Python + Nginx
-# ═══════════════════════════════════════════════════════════
-echo "[10/12] Installing Python dependencies..."
-apt-get install -y python3 python3-pip python3-venv nginx sqlite3
-pip3 install --break-system-packages Flask==3.0.0 Flask-CORS==4.0.0 PyMySQL==1.1.0 2>&1 | grep -v "WARNING" || true
-
-# Configure Nginx user (CRITICAL)
-sed -i 's/^user .*/user www-data;/' /etc/nginx/nginx.conf
-if ! grep -q "^user www-data;" /etc/nginx/nginx.conf; then
-    sed -i '1iuser www-data;' /etc/nginx/nginx.conf
-fi
-
-echo "✅ Python + Nginx installed"
-
-# ═══════════════════════════════════════════════════════════
-# STEP 11: Setup Directory Structure
-# ═══════════════════════════════════════════════════════════
-echo "[11/12] Creating directory structure..."
-
-mkdir -p /var/lib/hosting-manager
-mkdir -p /var/log/hosting-manager
-mkdir -p /var/www/domains
-mkdir -p /var/www/wordpress
-
-chown -R {self.username}:{self.username} /var/lib/hosting-manager
-chown -R {self.username}:{self.username} /var/log/hosting-manager
-chown -R {self.username}:{self.username} /var/www/domains
-chown -R www-data:www-data /var/www/wordpress
-
-usermod -aG www-data {self.username}
-
-chmod -R 2775 /var/www/wordpress
-
-mkdir -p /run/nginx
-chown -R www-data:www-data /run/nginx
-chmod -R 755 /run/nginx
-
-# Make config directories writable (CRITICAL FIX)
-chown -R {self.username}:www-data /etc/nginx/sites-available
-chown -R {self.username}:www-data /etc/nginx/sites-enabled
-chmod 775 /etc/nginx/sites-available
-chmod 775 /etc/nginx/sites-enabled
-chmod 775 /etc/php/8.3/fpm/pool.d
-
-mkdir -p /var/lib/hosting-manager/wordpress-docker
-chown {self.username}:{self.username} /var/lib/hosting-manager/wordpress-docker
-
-echo "✅ Directory structure created"
-
-# ═══════════════════════════════════════════════════════════
-# STEP 12: Install Docker + Docker Compose (for WordPress containers)
-# ═══════════════════════════════════════════════════════════
-echo "[12/13] Installing Docker and Docker Compose..."
-apt-get install -y ca-certificates curl
-install -m 0755 -d /etc/apt/keyrings
-curl -fsSL https://download.docker.com/linux/ubuntu/gpg -o /etc/apt/keyrings/docker.asc
-chmod a+r /etc/apt/keyrings/docker.asc
-echo "deb [arch=$(dpkg --print-architecture) signed-by=/etc/apt/keyrings/docker.asc] https://download.docker.com/linux/ubuntu $(. /etc/os-release && echo "$VERSION_CODENAME") stable" | tee /etc/apt/sources.list.d/docker.list > /dev/null
-apt-get update -qq
-apt-get install -y docker-ce docker-ce-cli containerd.io docker-buildx-plugin docker-compose-plugin
-usermod -aG docker {self.username}
-systemctl enable docker
-systemctl start docker
-echo "Docker: $(docker --version)"
-echo "Compose: $(docker compose version 2>/dev/null || echo 'plugin')"
-echo "✅ Docker and Docker Compose installed"
-
-# ═══════════════════════════════════════════════════════════
-# STEP 13: Deploy Application
-# ═══════════════════════════════════════════════════════════
-echo "[13/13] Deploying application..."
-
-mkdir -p /opt/hosting-manager
-chown {self.username}:{self.username} /opt/hosting-manager
-
-if [ -d "/opt/hosting-manager/.git" ]; then
-    cd /opt/hosting-manager
-    sudo -u {self.username} git fetch --all
-    sudo -u {self.username} git reset --hard origin/main
-    sudo -u {self.username} git clean -fd
-else
-    sudo -u {self.username} git clone {self.repo_url} /opt/hosting-manager
-fi
-
-cd /opt/hosting-manager
-pip3 install --break-system-packages -r requirements.txt 2>&1 | grep -v "WARNING" || true
-
-# Create environment file
-MYSQL_ROOT_PASS=$(cat /root/.mysql_root_password)
-echo "MYSQL_ROOT_PASSWORD=$MYSQL_ROOT_PASS" > /opt/hosting-manager/.env
-echo "WORDPRESS_BASE_DIR=/var/www/wordpress" >> /opt/hosting-manager/.env
-
-chown {self.username}:{self.username} /opt/hosting-manager/.env
-
-# Create systemd service
-cat > /etc/systemd/system/hosting-manager.service << 'SERVICEEOF'
-[Unit]
-Description=Hosting Manager API
-After=network.target mysql.service php8.3-fpm.service
-Requires=mysql.service php8.3-fpm.service
-
-[Service]
-Type=simple
-User={self.username}
-Group={self.username}
-WorkingDirectory=/opt/hosting-manager
-Environment="PYTHONUNBUFFERED=1"
-Environment="PATH=/usr/local/bin:/usr/bin"
-ExecStart=/usr/bin/python3 /opt/hosting-manager/app.py
-Restart=always
-RestartSec=3
-
-[Install]
-WantedBy=multi-user.target
-SERVICEEOF
-
-systemctl daemon-reload
-systemctl enable hosting-manager
-systemctl restart hosting-manager
-sleep 5
-
-echo "✅ Application deployed"
-
-# Configure Nginx
-rm -f /etc/nginx/sites-enabled/default
-
-cat > /etc/nginx/sites-available/hosting-manager-api << 'NGINXEOF'
-server {{
-    listen 80 default_server;
-    server_name _;
-
-    location /api/ {{
-        proxy_pass http://127.0.0.1:5000;
-        proxy_http_version 1.1;
-        proxy_set_header Host $host;
-        proxy_set_header X-Real-IP $remote_addr;
-    }}
-
-    location / {{
-        return 200 '<!DOCTYPE html><html><head><title>Hosting Manager</title></head><body><h1>Hosting Manager Active</h1></body></html>';
-        add_header Content-Type text/html;
-    }}
-}}
-NGINXEOF
-
-ln -sf /etc/nginx/sites-available/hosting-manager-api /etc/nginx/sites-enabled/
-nginx -t && systemctl reload nginx
-
-echo ""
-echo "============================================"
-echo "✅ Installation Complete!"
-echo "============================================"
-echo ""
-echo "Next steps:"
-echo "  1. Log out and log back in: exit && ssh {self.username}@{self.server}"
-echo "  2. Test API: curl http://localhost:5000/api/health"
-echo "  3. Deploy WordPress:"
-echo '     curl -X POST http://localhost:5000/api/wordpress/deploy \\'
-echo '       -H "Content-Type: application/json" \\'
-echo '       -d '"'"'{{"name":"site","domain":"example.com","adminEmail":"admin@example.com","adminPassword":"pass","siteTitle":"Site"}}'"'"
-echo ""
-echo "MySQL password: $(cat /etc/hosting-manager/mysql_root_password)"
-echo ""
-"""
+        repo_url = shlex.quote(self.repo_url)
+        apt_packages = "\n        ".join(
+            textwrap.wrap(" ".join(SYSTEM_PACKAGES), 72, break_on_hyphens=False)
+        )
+        # aria2 would bypass the LAN apt cache, which is faster anyway
+        apt_prefetch = "no" if self.apt_cache else "yes"
+        ssh_public_key = shlex.quote(self.ssh_public_key)
+        if skip_key_setup:
+            # The user already logs in with our key: mark only the key step
+            # done, so authorized_keys (e.g. from cloud-init) is left as is.
+            # Step 2 still runs - it creates the hosting group and adds the
+            # existing account to it - and step 4 still applies the sshd config.
+            user_setup = 'touch "$STEP_MARKERS"/step3.done'
+        else:
+            user_setup = ""
+        pip_source = (
+            f"--no-index --find-links {REMOTE_WHEELHOUSE}" if self.wheelhouse else ""
+        )
+        if self.apt_cache:
+            # HTTPS repositories (Docker) bypass the cache and connect directly
+            apt_proxy = (
+                "printf 'Acquire::http::Proxy \"%s\";\\n"
+                "Acquire::https::Proxy \"false\";\\n' "
+                f"{shlex.quote(self.apt_cache)} > /etc/apt/apt.conf.d/00proxy"
+            )
+        else:
+            apt_proxy = "rm -f /etc/apt/apt.conf.d/00proxy"
+
+        return render_template(
+            "install.sh",
+            username=self.username,
+            server=self.server,
+            repo_url=repo_url,
+            ssh_public_key=ssh_public_key,
+            mysql_root_password=self.mysql_root_password,
+            apt_packages=apt_packages,
+            apt_prefetch=apt_prefetch,
+            apt_proxy=apt_proxy,
+            apt_download_jobs=APT_DOWNLOAD_JOBS,
+            apt_connections_per_file=APT_CONNECTIONS_PER_FILE,
+            user_setup=user_setup,
+            pip_source=pip_source,
+            full_upgrade="yes" if self.full_upgrade else "no",
+            force_steps=" ".join(str(step) for step in self.force_steps),
+        )
+
+    def upload_config_payload(self):
+        """Install every config file on the server with a single tar extract"""
+        print_step("Uploading configuration files...")
+        # A sudoers file that fails to parse breaks sudo for everyone, so
+        # check it in the same round trip and take it back out if it is bad
+        sudoers = f"/etc/sudoers.d/{self.username}"
+        subprocess.run(
+            self.build_ssh_command(
+                "tar -xzf - -C / --no-same-owner --no-overwrite-dir && "
+                f"{{ visudo -cqf {sudoers} || {{ rm -f {sudoers}; exit 1; }}; }}"
+            ),
+            env=self.ssh_env,
+            input=build_config_payload(self.username),
+            check=True,
+        )
+        print_success("Configuration files uploaded")
+
+    def upload_wheelhouse(self):
+        """Upload the local wheelhouse so pip on the server installs offline"""
+        print_step(f"Uploading wheelhouse from {self.wheelhouse}...")
+        subprocess.run(
+            self.build_ssh_command(
+                f"mkdir -p {REMOTE_WHEELHOUSE} && tar -xzf - -C {REMOTE_WHEELHOUSE}"
+            ),
+            env=self.ssh_env,
+            input=build_wheelhouse_archive(self.wheelhouse),
+            check=True,
+        )
+        print_success("Wheelhouse uploaded")
+
+    def run_check(self, remote_command, user="root", expected=None, timeout=0):
+        """Run a check command on the server and return whether it passed
+
+        Failed attempts are retried with exponential backoff for up to
+        timeout seconds, for services that may still be coming up.
+        """
+        options = ["-o", "ConnectTimeout=2"]
+        if user != "root":
+            # Key auth only: fail fast instead of prompting for a password
+            options += ["-o", "BatchMode=yes"]
+        command = self.build_ssh_command(remote_command, user=user, ssh_args=options)
+
+        deadline = time.monotonic() + timeout
+        delay = 0.25
+        while True:
+            result = subprocess.run(
+                command, env=self.ssh_env, capture_output=True, text=True
+            )
+            ok = result.returncode == 0 and (
+                expected is None or result.stdout.strip() == expected
+            )
+            if ok or time.monotonic() + delay > deadline:
+                return ok
+            time.sleep(delay)
+            delay = min(delay * 2, 2.0)
+
+    def check_api_health(self):
+        """Check the API answers through nginx from outside the server"""
+        try:
+            with urllib.request.urlopen(
+                f"http://{self.server}/api/health", timeout=5
+            ) as response:
+                return response.status == 200
+        except OSError:
+            return False
+
+    def verify_installation(self):
+        """Run the post-install checks concurrently"""
+        print_step("Verifying installation...")
+        # sshd was just reloaded, so the user checks retry for a while
+        checks = {
+            f"SSH login as {self.username}": lambda: self.run_check(
+                "whoami",
+                user=self.username,
+                expected=self.username,
+                timeout=SSH_VERIFY_TIMEOUT,
+            ),
+            f"Docker access for {self.username}": lambda: self.run_check(
+                "docker ps", user=self.username, timeout=SSH_VERIFY_TIMEOUT
+            ),
+            "hosting-manager service": lambda: self.run_check(
+                "systemctl is-active --quiet hosting-manager"
+            ),
+            "API through nginx": self.check_api_health,
+        }
+
+        # Each check waits on the network, so running them side by side takes
+        # as long as the slowest one rather than the sum
+        with concurrent.futures.ThreadPoolExecutor(len(checks)) as pool:
+            futures = {name: pool.submit(check) for name, check in checks.items()}
+
+        all_ok = True
+        for name, future in futures.items():
+            if future.result():
+                print(f"  ✅ {name}")
+            else:
+                print(f"  ❌ {name}")
+                all_ok = False
+
+        if all_ok:
+            print_success("All checks passed")
+        else:
+            print_warning(
+                f"Some checks failed - if SSH login as {self.username} failed, "
+                f"check /home/{self.username}/.ssh/authorized_keys as root"
+            )
 
     def install(self):
         """Run installation"""
@@ -497,35 +492,44 @@ echo ""
             print("Aborted.")
             sys.exit(0)
 
-        install_script = self.build_installation_script()
+        skip_key_setup = self.probe_user_access()
+        if skip_key_setup:
+            print_success(
+                f"{self.username} already has SSH access - skipping key setup"
+            )
+        install_script = self.build_installation_script(skip_key_setup)
 
         print_step("Starting installation...")
         print_warning("This will take 5-10 minutes...")
         print()
 
         try:
-            if self.root_password:
-                ssh_cmd = f"sshpass -p '{self.root_password}' ssh -o StrictHostKeyChecking=no root@{self.server} 'bash -s'"
-            else:
-                ssh_cmd = (
-                    f"ssh -o StrictHostKeyChecking=no root@{self.server} 'bash -s'"
-                )
+            self.open_connection()
+            self.upload_config_payload()
+            if self.wheelhouse:
+                self.upload_wheelhouse()
 
+            # Default (full) buffering: the script is written once and then
+            # flushed by close(), rather than in one write per line
             process = subprocess.Popen(
-                ssh_cmd,
-                shell=True,
+                self.build_ssh_command(REMOTE_RUN_SCRIPT),
+                env=self.ssh_env,
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
             )
 
-            process.stdin.write(install_script)
+            process.stdin.write(gzip.compress(install_script.encode()))
             process.stdin.close()
 
-            for line in process.stdout:
-                print(line, end="")
+            # Copy output in chunks of whatever has arrived (up to 64 KiB)
+            # instead of decoding and printing it line by line. The chunks go
+            # to the byte layer, so flush what print() has buffered first to
+            # keep the order when stdout is a pipe or a file
+            sys.stdout.flush()
+            while chunk := process.stdout.read1(65536):
+                sys.stdout.buffer.write(chunk)
+                sys.stdout.buffer.flush()
 
             return_code = process.wait()
 
@@ -533,6 +537,8 @@ echo ""
                 print_error(f"Installation failed with exit code {return_code}")
                 sys.exit(1)
 
+            self.verify_installation()
+
             print()
             print_header("✅ Installation Successful!")
 
@@ -540,6 +546,20 @@ echo ""
             print_error(f"Installation failed: {e}")
             sys.exit(1)
 
+        finally:
+            self.close_connections()
+
+
+def parse_step_list(value):
+    """Parse --force-steps: comma-separated step numbers from 1 to 12"""
+    try:
+        steps = sorted({int(step) for step in value.split(",")})
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a list of step numbers: {value}")
+    if steps[0] < 1 or steps[-1] > 12:
+        raise argparse.ArgumentTypeError("steps run from 1 to 12")
+    return steps
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -549,6 +569,25 @@ def main():
     parser.add_argument("--user", required=True, help="Username (e.g., deploy)")
     parser.add_argument("--repo", required=True, help="Git repository URL")
     parser.add_argument("--root-password", help="Root password (optional)")
+    parser.add_argument(
+        "--wheelhouse",
+        help="Directory of pre-downloaded wheels to install from (optional)",
+    )
+    parser.add_argument(
+        "--apt-cache",
+        help="apt-cacher-ng proxy, e.g. 192.168.1.10:3142 (optional)",
+    )
+    parser.add_argument(
+        "--full-upgrade",
+        action="store_true",
+        help="Also upgrade every installed package (slow on fresh images)",
+    )
+    parser.add_argument(
+        "--force-steps",
+        type=parse_step_list,
+        default=(),
+        help="Comma-separated steps (1-12) to redo on a rerun, e.g. 6,9",
+    )
 
     args = parser.parse_args()
 
@@ -557,6 +596,10 @@ def main():
         username=args.user,
         repo_url=args.repo,
         root_password=args.root_password,
+        wheelhouse=args.wheelhouse,
+        apt_cache=args.apt_cache,
+        full_upgrade=args.full_upgrade,
+        force_steps=args.force_steps,
     )
 
     installer.install()
@@ -0,0 +1,16 @@
+"""
+Hosting Manager - SSH options shared by the deployment scripts
+fresh_install.py and update_deployment.py import these, so both use the
+same master socket for a given user@host
+"""
+
+# Reuse one SSH connection per user@host for all commands in a run instead of
+# a fresh TCP handshake and key exchange for each
+SSH_MULTIPLEX_OPTIONS = [
+    "-o",
+    "ControlMaster=auto",
+    "-o",
+    "ControlPath=~/.ssh/hosting-manager-%C",
+    "-o",
+    "ControlPersist=60",
+]
@@ -0,0 +1,610 @@
+#!/usr/bin/env bash
+# Server installation script, rendered by fresh_install.py, sent over SSH
+# and run as root from a temp file. Placeholders (@ followed by a name in
+# braces) are filled in by the installer; everything else is plain bash.
+
+set -e
+
+# Every apt/dpkg run below is unattended: no debconf questions, no changelog
+# pager, and no needrestart scan of all running processes after each one.
+# apt runs with -qq (and dpkg without a pty), so only errors and dpkg's own
+# per-package lines come back over SSH.
+export DEBIAN_FRONTEND=noninteractive APT_LISTCHANGES_FRONTEND=none NEEDRESTART_SUSPEND=1
+
+echo "============================================"
+echo "Hosting Manager - Production Installation"
+echo "All Fixes Incorporated - Battle Tested"
+echo "============================================"
+
+# Independent steps run as background jobs. Each job logs to its own file
+# so output does not interleave; logs are replayed when the jobs are joined.
+BG_JOBS=""
+
+run_background() {
+    local name=$1
+    shift
+    "$@" > "/tmp/hosting-manager-$name.log" 2>&1 &
+    BG_JOBS="$BG_JOBS $!:$name"
+}
+
+wait_background() {
+    local job pid name failed=0
+    for job in $BG_JOBS; do
+        pid=${job%%:*}
+        name=${job#*:}
+        if wait "$pid"; then
+            cat "/tmp/hosting-manager-$name.log"
+        else
+            echo "❌ Background job '$name' failed:"
+            cat "/tmp/hosting-manager-$name.log"
+            failed=1
+        fi
+        rm -f "/tmp/hosting-manager-$name.log"
+    done
+    BG_JOBS=""
+    return $failed
+}
+
+# Completed steps leave a marker so a rerun skips them; the application
+# deploy (step 13) always runs. Steps given with --force-steps run again
+# regardless; remove the markers to force a full reinstall.
+STEP_MARKERS=/var/lib/hosting-manager/.install
+FORCE_STEPS=" @{force_steps} "
+mkdir -p "$STEP_MARKERS"
+
+step_done() {
+    [ -f "$STEP_MARKERS/step$1.done" ] && [[ "$FORCE_STEPS" != *" $1 "* ]]
+}
+
+run_step() {
+    local number=$1 name=$2
+    if step_done "$number"; then
+        echo "[$number/13] Skipping $name (already done)"
+        return 0
+    fi
+    "step_$name"
+    touch "$STEP_MARKERS/step$number.done"
+}
+
+# Poll a command until it succeeds instead of sleeping for a fixed time.
+# Usage: wait_for TIMEOUT_SECONDS COMMAND [ARGS...]
+wait_for() {
+    local deadline=$((SECONDS + $1))
+    shift
+    until "$@" >/dev/null 2>&1; do
+        [ "$SECONDS" -lt "$deadline" ] || return 1
+        sleep 0.5
+    done
+}
+
+@{user_setup}
+
+# Route package downloads through the LAN apt cache (--apt-cache), if any.
+# Written on every run so adding or dropping the flag takes effect on rerun.
+@{apt_proxy}
+
+# curl fetches the Docker key in step 1 and the downloads below; stock
+# Ubuntu images already have it
+if ! command -v curl >/dev/null; then
+    apt-get update -qq
+    apt-get install -y -qq ca-certificates curl
+fi
+
+# ═══════════════════════════════════════════════════════════
+# Downloads that need no packages start now and overlap with steps 1-2.
+# Verified artifacts are kept in the cache, so a rerun does not refetch them.
+# ═══════════════════════════════════════════════════════════
+DOWNLOAD_CACHE=/var/cache/hosting-manager
+mkdir -p "$DOWNLOAD_CACHE"
+
+download_nodejs() {
+    # Prebuilt Node.js 20 from nodejs.org for step 6 - no apt repository.
+    # SHASUMS256.txt names the current 20.x release and its checksum.
+    local arch=x64
+    if [ "$(uname -m)" = aarch64 ]; then
+        arch=arm64
+    fi
+    local dist=https://nodejs.org/dist/latest-v20.x
+    local sum tarball
+    sum=$(curl -fsSL "$dist/SHASUMS256.txt" | grep "linux-$arch.tar.xz$")
+    tarball=${sum##* }
+
+    cd "$DOWNLOAD_CACHE"
+    if ! echo "$sum" | sha256sum -c --quiet >/dev/null 2>&1; then
+        curl -fsSL -o "$tarball" "$dist/$tarball"
+        echo "$sum" | sha256sum -c --quiet
+    fi
+    # Drop tarballs of earlier 20.x releases so reruns do not pile them up
+    local old
+    for old in node-v*-linux-*.tar.xz; do
+        [ "$old" = "$tarball" ] || rm -f "$old"
+    done
+    ln -sf "$tarball" node-linux.tar.xz
+    echo "✅ Downloaded $tarball"
+}
+
+download_wp_cli() {
+    # WP-CLI phar for step 9, checked against the published SHA-512
+    local url=https://raw.githubusercontent.com/wp-cli/builds/gh-pages/phar/wp-cli.phar
+    local sum
+    sum="$(curl -fsSL "$url.sha512")  wp-cli.phar"
+
+    cd "$DOWNLOAD_CACHE"
+    if ! echo "$sum" | sha512sum -c --quiet >/dev/null 2>&1; then
+        curl -fsSL -o wp-cli.phar "$url"
+        echo "$sum" | sha512sum -c --quiet
+    fi
+    echo "✅ Downloaded wp-cli.phar"
+}
+
+if ! step_done 6; then
+    run_background node-download download_nodejs
+fi
+if ! step_done 9; then
+    run_background wp-cli-download download_wp_cli
+fi
+
+# ═══════════════════════════════════════════════════════════
+# STEP 1: Install System Packages
+# ═══════════════════════════════════════════════════════════
+step_base_packages() {
+    echo "[1/13] Installing system packages..."
+
+    # Recommends/Suggests are already off: apt.conf.d/01norecommends comes
+    # in the config payload, so only the packages named here get installed
+    # Register the Docker repository up front so every package below comes
+    # from one package list refresh and a single apt-get install transaction
+    install -m 0755 -d /etc/apt/keyrings
+    curl -fsSL https://download.docker.com/linux/ubuntu/gpg -o /etc/apt/keyrings/docker.asc
+    chmod a+r /etc/apt/keyrings/docker.asc
+    echo "deb [arch=$(dpkg --print-architecture) signed-by=/etc/apt/keyrings/docker.asc] https://download.docker.com/linux/ubuntu $(. /etc/os-release && echo "$VERSION_CODENAME") stable" | tee /etc/apt/sources.list.d/docker.list > /dev/null
+
+    APT_PACKAGES=(
+        @{apt_packages}
+    )
+    apt-get update -qq
+
+    # mysql-server's postinst sets the root password as it initialises the
+    # data directory when one is preseeded (and wipes the answer afterwards),
+    # which saves step 7 a stop/start cycle of mysqld
+    debconf-set-selections << 'DEBCONF'
+mysql-server mysql-server/root_password password @{mysql_root_password}
+mysql-server mysql-server/root_password_again password @{mysql_root_password}
+DEBCONF
+
+    # dpkg fsyncs every file it unpacks. eatmydata turns those into no-ops for
+    # the bulk install below; one sync afterwards flushes it all at once.
+    # apt fetches one file at a time per mirror. Pull the archives into apt's
+    # cache with aria2 first (several files and connections at once); apt-get
+    # install then finds them there and only fetches anything missed.
+    # Both helpers come in one small transaction ahead of the main one.
+    APT_HELPERS=(eatmydata)
+    if [ "@{apt_prefetch}" = yes ]; then
+        APT_HELPERS+=(aria2)
+    fi
+    apt-get install -y -qq "${APT_HELPERS[@]}"
+
+    if [ "@{apt_prefetch}" = yes ]; then
+        apt-get install -y -qq --print-uris "${APT_PACKAGES[@]}" \
+            | sed -n "s/^'\([^']*\)' \([^ ]*\) .*/\1\n  out=\2/p" > /tmp/apt-uris
+        aria2c -q -j @{apt_download_jobs} -x @{apt_connections_per_file} -s @{apt_connections_per_file} \
+            --min-split-size=1M -d /var/cache/apt/archives -i /tmp/apt-uris || true
+        rm -f /tmp/apt-uris
+    fi
+
+    eatmydata apt-get install -y -qq -o Dpkg::Use-Pty=0 "${APT_PACKAGES[@]}"
+    sync
+    echo "✅ System packages installed"
+}
+run_step 1 base_packages
+
+# ═══════════════════════════════════════════════════════════
+# STEP 2: Create User
+# ═══════════════════════════════════════════════════════════
+step_user() {
+    echo "[2/13] Setting up user @{username}..."
+
+    # Every supplementary group in one go (step 1 created www-data and
+    # docker). This also keeps the parallel steps below off /etc/group.
+    groupadd -f hosting
+    if id "@{username}" &>/dev/null; then
+        # Keep an existing account and its home directory; only add the groups
+        usermod -aG sudo,www-data,docker,hosting @{username}
+    else
+        useradd -m -s /bin/bash -G sudo,www-data,docker,hosting @{username}
+    fi
+    chmod 755 /home/@{username}
+    echo "✅ User ready"
+}
+run_step 2 user
+
+# Join the downloads started before step 1
+wait_background
+
+# ═══════════════════════════════════════════════════════════
+# STEP 3: Setup SSH
+# ═══════════════════════════════════════════════════════════
+step_ssh_keys() {
+    echo "[3/13] Setting up SSH..."
+
+    # install(1) creates each path with its owner and mode in one go
+    install -d -m 700 -o @{username} -g @{username} /home/@{username}/.ssh
+    printf '%s\n' @{ssh_public_key} | install -m 600 -o @{username} -g @{username} /dev/stdin /home/@{username}/.ssh/authorized_keys
+    echo "✅ SSH configured"
+}
+
+# ═══════════════════════════════════════════════════════════
+# STEP 4: Configure SSH Daemon
+# ═══════════════════════════════════════════════════════════
+step_sshd() {
+    echo "[4/13] Configuring SSH daemon..."
+
+    # The drop-in 10-hosting-manager.conf comes in the config payload instead
+    # of sed-editing sshd_config. sshd keeps the first value it reads, and the
+    # drop-in directory is included at the top of the main config.
+    if ! grep -q '^Include /etc/ssh/sshd_config.d/' /etc/ssh/sshd_config; then
+        sed -i '1i Include /etc/ssh/sshd_config.d/*.conf' /etc/ssh/sshd_config
+    fi
+
+    # Reload rather than restart - no need to stop the daemon. The unit is
+    # ssh on Ubuntu and sshd elsewhere; if neither is running there is
+    # nothing to reload.
+    systemctl reload ssh 2>/dev/null || systemctl reload sshd 2>/dev/null || true
+
+    echo "✅ SSH daemon configured"
+}
+
+# ═══════════════════════════════════════════════════════════
+# STEP 5: Firewall
+# ═══════════════════════════════════════════════════════════
+step_firewall() {
+    echo "[5/13] Configuring firewall..."
+    # All ports come from one application profile in the config payload, and
+    # the rule is in place before enabling so the ruleset is loaded once
+    ufw allow hosting-manager
+    ufw --force enable
+    echo "✅ Firewall configured"
+}
+
+# ═══════════════════════════════════════════════════════════
+# STEP 6: Install Node.js + PM2
+# ═══════════════════════════════════════════════════════════
+step_nodejs() {
+    echo "[6/13] Installing Node.js ecosystem..."
+
+    # Unpack the tarball downloaded before step 1 into /usr/local
+    tar -xJf "$DOWNLOAD_CACHE/node-linux.tar.xz" -C /usr/local --strip-components=1 \
+        --no-same-owner --no-overwrite-dir --wildcards '*/bin' '*/include' '*/lib' '*/share'
+
+    npm install -g --silent --no-fund --no-audit pm2 pnpm
+
+    echo 'export PATH="/usr/local/bin:/usr/bin:$PATH"' >> /home/@{username}/.bashrc
+    chown @{username}:@{username} /home/@{username}/.bashrc
+
+    # Run as the user, pm2 startup only prints the root command to paste. We
+    # are already root, so run that command directly with the init system named.
+    pm2 startup systemd -u @{username} --hp /home/@{username} > /dev/null || true
+
+    echo "Node.js: $(node --version)"
+    echo "PM2: $(pm2 --version)"
+    echo "✅ Node.js + PM2 installed"
+}
+
+# ═══════════════════════════════════════════════════════════
+# STEP 7: Install MySQL Server (BULLETPROOF)
+# ═══════════════════════════════════════════════════════════
+step_mysql() {
+    echo "[7/13] Installing MySQL server..."
+
+    # mysql-server comes from the step 1 transaction. If an earlier attempt
+    # at this step failed part-way, start again from a clean slate. The marker
+    # is cleared once the step succeeds, so a --force-steps rerun of a working
+    # server only resets the passwords and users and keeps the databases.
+    if [ -f "$STEP_MARKERS/step7.attempted" ]; then
+        systemctl stop mysql 2>/dev/null || true
+        apt-get remove --purge -y -qq mysql-server mysql-client mysql-common 2>/dev/null || true
+        rm -rf /etc/mysql /var/lib/mysql /var/log/mysql
+        # eatmydata came with step 1; the reinstall skips fsyncs like that did
+        eatmydata apt-get install -y -qq -o Dpkg::Use-Pty=0 mysql-server
+        sync
+    fi
+    touch "$STEP_MARKERS/step7.attempted"
+    rm -rf /etc/hosting-manager/mysql_root_password /root/.mysql_root_password
+    rm -rf /root/.my.cnf /root/.mysql /home/@{username}/.my.cnf /home/@{username}/.mysql
+
+    install -d -o mysql -g mysql -m 755 /var/run/mysqld
+
+    systemctl enable --now mysql
+    wait_for 30 mysqladmin ping || { echo "❌ MySQL did not start"; exit 1; }
+
+    # Generated by the installer (URL-safe alphabet, so no quoting issues)
+    MYSQL_ROOT_PASS='@{mysql_root_password}'
+
+    # Root's login for the mysql calls below, in a private option file rather
+    # than -p on each command line (visible in ps, and warned about each time).
+    # Step 7 runs as its own background job, so the trap is local to it.
+    ROOT_CNF=$(mktemp)
+    trap 'rm -f "$ROOT_CNF"' EXIT
+    printf '[client]\nuser=root\npassword=%s\n' "$MYSQL_ROOT_PASS" > "$ROOT_CNF"
+
+    # Method 1: Try init file - only needed when the step 1 preseed did not
+    # take (e.g. mysql-server was reinstalled above)
+    if ! mysql --defaults-extra-file="$ROOT_CNF" -e "SELECT 1;" >/dev/null 2>&1; then
+        echo "Setting MySQL password (init file method)..."
+        systemctl stop mysql
+
+        # mysqld reads the init file after dropping to the mysql user
+        install -o mysql -m 600 /dev/stdin /tmp/mysql-init.sql << MYSQLINIT
+ALTER USER 'root'@'localhost' IDENTIFIED WITH mysql_native_password BY '$MYSQL_ROOT_PASS';
+FLUSH PRIVILEGES;
+MYSQLINIT
+
+        mysqld --user=mysql --init-file=/tmp/mysql-init.sql &
+        MYSQLD_PID=$!
+        # The init file runs before mysqld accepts connections
+        wait_for 60 mysqladmin ping || true
+        kill $MYSQLD_PID 2>/dev/null || true
+        pkill -f "mysqld.*init-file" 2>/dev/null || true
+        wait $MYSQLD_PID 2>/dev/null || true
+        rm -f /tmp/mysql-init.sql
+
+        systemctl start mysql
+        wait_for 30 mysqladmin ping || { echo "❌ MySQL did not restart"; exit 1; }
+    fi
+
+    # Method 2: Force it with socket auth (CRITICAL FIX)
+    # Ubuntu 24.04 MySQL is stubborn - always force password auth. A preseeded
+    # root already has a password, so log in with it before trying the socket.
+    echo "Forcing password authentication (Ubuntu 24.04 fix)..."
+    ROOT_AUTH_SQL="ALTER USER 'root'@'localhost' IDENTIFIED WITH mysql_native_password BY '$MYSQL_ROOT_PASS'; FLUSH PRIVILEGES;"
+    mysql --defaults-extra-file="$ROOT_CNF" -e "$ROOT_AUTH_SQL" 2>/dev/null \
+        || mysql -e "$ROOT_AUTH_SQL" 2>/dev/null || true
+
+    # Final verification
+    if ! mysql --defaults-extra-file="$ROOT_CNF" -e "SELECT 1;" >/dev/null 2>&1; then
+        echo "❌ MySQL password setup failed"
+        exit 1
+    fi
+
+    echo "✅ MySQL password set successfully"
+
+    # Create users
+    echo "Creating MySQL users..."
+
+    # One client session for all of it; the batch stops at the first failing
+    # statement. CREATE USER and GRANT take effect without FLUSH PRIVILEGES.
+    mysql --defaults-extra-file="$ROOT_CNF" << MYSQLUSERS
+DROP USER IF EXISTS 'hosting_manager'@'localhost';
+CREATE USER 'hosting_manager'@'localhost' IDENTIFIED WITH mysql_native_password BY '$MYSQL_ROOT_PASS';
+GRANT ALL PRIVILEGES ON *.* TO 'hosting_manager'@'localhost' WITH GRANT OPTION;
+DROP USER IF EXISTS 'wp_manager'@'localhost';
+CREATE USER 'wp_manager'@'localhost' IDENTIFIED WITH mysql_native_password BY '$MYSQL_ROOT_PASS';
+GRANT CREATE, DROP, SELECT, INSERT, UPDATE, DELETE, ALTER, INDEX, CREATE TEMPORARY TABLES, LOCK TABLES ON *.* TO 'wp_manager'@'localhost';
+MYSQLUSERS
+
+    # Save the password once; step 13 and reruns read it back from here
+    mkdir -p /etc/hosting-manager
+    install -g hosting -m 640 /dev/stdin /etc/hosting-manager/mysql_root_password <<< "$MYSQL_ROOT_PASS"
+
+    # Owner and mode are set as the directory and file are created, so the
+    # password is never readable by anyone else, even briefly
+    install -d -o @{username} -g @{username} -m 700 /home/@{username}/.mysql
+    install -o @{username} -g @{username} -m 600 /dev/stdin /home/@{username}/.mysql/my.cnf << MYCNF
+[client]
+user=root
+password=$MYSQL_ROOT_PASS
+host=localhost
+MYCNF
+
+    # The root login was checked above and the user batch would have stopped
+    # the step on any error, so there is nothing left to query
+    rm -f "$STEP_MARKERS/step7.attempted"
+    echo "✅ MySQL installed: root, hosting_manager, wp_manager"
+}
+
+# ═══════════════════════════════════════════════════════════
+# STEP 8: Install PHP and PHP-FPM
+# ═══════════════════════════════════════════════════════════
+step_php() {
+    echo "[8/13] Configuring PHP 8.3 and PHP-FPM..."
+
+    # php.ini is left untouched; the overrides arrive with the config payload
+    # as conf.d/99-hosting.ini, which PHP-FPM reads after it
+
+    # Create log directory (CRITICAL)
+    install -d -o www-data -g www-data -m 755 /var/log/php8.3-fpm
+
+    echo "PHP: $(php --version | head -n1)"
+    echo "✅ PHP 8.3 and PHP-FPM installed"
+}
+
+# ═══════════════════════════════════════════════════════════
+# STEP 9: Install WP-CLI
+# ═══════════════════════════════════════════════════════════
+step_wp_cli() {
+    echo "[9/13] Installing WP-CLI..."
+    # Downloaded and verified before step 1
+    install -m 755 "$DOWNLOAD_CACHE/wp-cli.phar" /usr/local/bin/wp
+    echo "WP-CLI: $(wp --version --allow-root)"
+    echo "✅ WP-CLI installed"
+}
+
+# ═══════════════════════════════════════════════════════════
+# STEP 10: Configure Nginx
+# ═══════════════════════════════════════════════════════════
+step_nginx() {
+    echo "[10/13] Configuring Nginx..."
+
+    # Configure Nginx user (CRITICAL)
+    sed -i 's/^user .*/user www-data;/' /etc/nginx/nginx.conf
+    if ! grep -q "^user www-data;" /etc/nginx/nginx.conf; then
+        sed -i '1iuser www-data;' /etc/nginx/nginx.conf
+    fi
+
+    echo "✅ Nginx configured"
+}
+
+# ═══════════════════════════════════════════════════════════
+# STEP 11: Setup Directory Structure
+# ═══════════════════════════════════════════════════════════
+step_directories() {
+    echo "[11/13] Creating directory structure..."
+
+    # install -d sets owner and mode as it creates each directory, so there
+    # is no recursive chown/chmod walk afterwards
+    install -d -o @{username} -g @{username} -m 755 /var/lib/hosting-manager \
+        /var/lib/hosting-manager/wordpress-docker /var/log/hosting-manager /var/www/domains
+    install -d -o www-data -g www-data -m 2775 /var/www/wordpress
+    install -d -o www-data -g www-data -m 755 /run/nginx
+
+    # Make config directories writable (CRITICAL FIX)
+    chown -R @{username}:www-data /etc/nginx/sites-available /etc/nginx/sites-enabled
+    chmod 775 /etc/nginx/sites-available /etc/nginx/sites-enabled /etc/php/8.3/fpm/pool.d
+
+    echo "✅ Directory structure created"
+}
+
+# ═══════════════════════════════════════════════════════════
+# STEP 12: Install Docker + Docker Compose (for WordPress containers)
+# ═══════════════════════════════════════════════════════════
+step_docker() {
+    echo "[12/13] Configuring Docker and Docker Compose..."
+    echo "Docker: $(docker --version)"
+    echo "Compose: $(docker compose version 2>/dev/null || echo 'plugin')"
+    echo "✅ Docker and Docker Compose installed"
+}
+
+# ═══════════════════════════════════════════════════════════
+# Application code and Python dependencies for step 13. Not a marked step:
+# it is refreshed on every run, but it only needs git, pip and the user so
+# it runs in the background.
+# ═══════════════════════════════════════════════════════════
+prepare_application() {
+    install -d -o @{username} -g @{username} /opt/hosting-manager
+
+    # All git work in one login shell as @{username} rather than a sudo per command
+    su - @{username} -s /bin/bash << 'USEREOF'
+set -e
+if [ -d /opt/hosting-manager/.git ]; then
+    cd /opt/hosting-manager
+    git fetch --depth 1 --no-tags origin main
+    git reset --hard FETCH_HEAD
+    git clean -fd
+    # Repeated shallow fetches leave one small pack each; fold them together
+    git gc --auto --quiet
+else
+    # Only the tip of main is needed to run the app - skip the history and tags
+    git clone --depth 1 --single-branch --no-tags --branch main @{repo_url} /opt/hosting-manager
+fi
+USEREOF
+    echo "✅ Application code fetched"
+
+    # One resolver pass, with constraints.txt pinning every transitive
+    # dependency so pip has no candidates to explore.
+    # The wheel cache lives in /var/cache/pip so reinstalls and
+    # update_deployment.py reuse downloads instead of hitting PyPI again.
+    mkdir -p /var/cache/pip
+    cd /opt/hosting-manager
+    PIP_CACHE_DIR=/var/cache/pip PIP_DISABLE_PIP_VERSION_CHECK=1 PIP_NO_INPUT=1 \
+        PIP_ROOT_USER_ACTION=ignore \
+        pip3 install -q --break-system-packages --prefer-binary @{pip_source} \
+        -c constraints.txt -r requirements.txt
+    echo "✅ Python dependencies installed"
+}
+
+# ═══════════════════════════════════════════════════════════
+# Steps 3-12 only need the packages from step 1 and the user from step 2,
+# not each other, so they run concurrently. Install time drops to roughly
+# the slowest step (MySQL) instead of the sum of all of them.
+# ═══════════════════════════════════════════════════════════
+echo "Running steps 3-12 in parallel (preparing the application meanwhile)..."
+run_background ssh-keys run_step 3 ssh_keys
+run_background sshd run_step 4 sshd
+run_background firewall run_step 5 firewall
+run_background nodejs run_step 6 nodejs
+run_background mysql run_step 7 mysql
+run_background php run_step 8 php
+run_background wp-cli run_step 9 wp_cli
+run_background nginx run_step 10 nginx
+run_background directories run_step 11 directories
+run_background docker run_step 12 docker
+run_background application prepare_application
+wait_background
+
+# Upgrading the whole base image (--full-upgrade) can rebuild the initramfs
+# and take minutes, so it is opt-in. It runs off the critical path: all later
+# steps are done with apt by now, so nothing else needs the dpkg lock. It
+# overlaps with the deploy below and is joined before the script finishes.
+UPGRADE_PID=
+if [ "@{full_upgrade}" = yes ]; then
+    echo "Upgrading system packages in background (log: /var/log/hosting-manager/apt-upgrade.log)..."
+    # Keep local changes to config files the upgrade would otherwise ask about.
+    # Skips fsyncs through eatmydata like step 1; sync flushes it all at the end
+    {
+        eatmydata apt-get upgrade -y -qq -o Dpkg::Use-Pty=0 \
+            -o Dpkg::Options::=--force-confdef -o Dpkg::Options::=--force-confold && sync
+    } > /var/log/hosting-manager/apt-upgrade.log 2>&1 &
+    UPGRADE_PID=$!
+else
+    # Security updates only: unattended-upgrades runs them under systemd, so
+    # they continue after this script instead of holding up the install
+    systemctl start --no-block apt-daily-upgrade.service
+fi
+
+# ═══════════════════════════════════════════════════════════
+# STEP 13: Deploy Application
+# ═══════════════════════════════════════════════════════════
+echo "[13/13] Deploying application..."
+
+# Code and Python dependencies were installed alongside steps 3-12
+cd /opt/hosting-manager
+
+# Create environment file (step 7 ran in the background or on an earlier
+# run, so its password variable is read back from the saved file)
+MYSQL_ROOT_PASS=$(< /etc/hosting-manager/mysql_root_password)
+install -o @{username} -g @{username} -m 600 /dev/stdin /opt/hosting-manager/.env << ENVEOF
+MYSQL_ROOT_PASSWORD=$MYSQL_ROOT_PASS
+WORDPRESS_BASE_DIR=/var/www/wordpress
+ENVEOF
+
+# hosting-manager.service comes in the config payload
+systemctl daemon-reload
+# Restart the API so a rerun picks up new code, then enable and start every
+# service in one call - systemd loads its unit graph once for the lot
+systemctl restart hosting-manager
+systemctl enable --now php8.3-fpm docker fail2ban nginx hosting-manager
+if ! wait_for 30 curl -fsS http://127.0.0.1:5000/api/health; then
+    echo "⚠️  API not responding yet - check: journalctl -u hosting-manager"
+fi
+
+echo "✅ Application deployed"
+
+# Enable the API site from the config payload
+rm -f /etc/nginx/sites-enabled/default
+ln -sf /etc/nginx/sites-available/hosting-manager-api /etc/nginx/sites-enabled/
+nginx -t && systemctl reload nginx
+
+if [ -n "$UPGRADE_PID" ]; then
+    echo "Waiting for system upgrade to finish..."
+    if wait $UPGRADE_PID; then
+        echo "✅ System packages upgraded"
+    else
+        echo "⚠️  apt-get upgrade failed - see /var/log/hosting-manager/apt-upgrade.log"
+    fi
+fi
+
+echo ""
+echo "============================================"
+echo "✅ Installation Complete!"
+echo "============================================"
+echo ""
+echo "Next steps:"
+echo "  1. Log out and log back in: exit && ssh @{username}@@{server}"
+echo "  2. Test API: curl http://localhost:5000/api/health"
+echo "  3. Deploy WordPress:"
+echo '     curl -X POST http://localhost:5000/api/wordpress/deploy \\'
+echo '       -H "Content-Type: application/json" \\'
+echo '       -d '"'"'{"name":"site","domain":"example.com","adminEmail":"admin@example.com","adminPassword":"pass","siteTitle":"Site"}'"'"
+echo ""
+echo "MySQL password: $MYSQL_ROOT_PASS"
+echo ""
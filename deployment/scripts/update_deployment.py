@@ -8,7 +8,12 @@ Supports both Next.js and WordPress deployments
 import argparse
 import subprocess
 import sys
-import time
+
+from ssh_options import SSH_MULTIPLEX_OPTIONS
+
+# Health polling after a restart: 60 x 0.5s = 30s upper bound
+HEALTH_POLL_ATTEMPTS = 60
+HEALTH_POLL_INTERVAL = 0.5
 
 
 class Colors:
@@ -36,11 +41,30 @@ def print_warning(message):
     print(f"{Colors.YELLOW}⚠️  {message}{Colors.NC}")
 
 
-def run_ssh(server, user, command):
-    """Execute SSH command"""
-    cmd = f"ssh -o StrictHostKeyChecking=no {user}@{server} '{command}'"
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-    return result
+def run_ssh(server, user, command, stream=False):
+    """Execute SSH command
+
+    With stream=True, output (stdout and stderr merged) is printed as it
+    arrives instead of being buffered until the command exits; it is still
+    returned in result.stdout.
+    """
+    cmd = (
+        ["ssh", "-o", "StrictHostKeyChecking=no"]
+        + SSH_MULTIPLEX_OPTIONS
+        + [f"{user}@{server}", command]
+    )
+    if not stream:
+        return subprocess.run(cmd, capture_output=True, text=True)
+
+    process = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    output = []
+    for line in process.stdout:
+        print(f"  {line}", end="")
+        output.append(line)
+    returncode = process.wait()
+    return subprocess.CompletedProcess(cmd, returncode, "".join(output), "")
 
 
 class Deployer:
@@ -76,6 +100,19 @@ class Deployer:
             print_error(f"Deployment failed: {e}")
             sys.exit(1)
 
+        finally:
+            self.close_connection()
+
+    def close_connection(self):
+        """Close the shared SSH connection rather than leaving it to idle out"""
+        subprocess.run(
+            ["ssh"]
+            + SSH_MULTIPLEX_OPTIONS
+            + ["-O", "exit", f"{self.user}@{self.server}"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
     def check_prerequisites(self):
         """Check that required services are available"""
         print_step("Checking prerequisites...")
@@ -84,7 +121,7 @@ class Deployer:
             "Git": "which git",
             "Python3": "which python3",
             "Docker": "which docker",
-            "Docker Compose": "which docker-compose",
+            "Docker Compose": "docker compose version",
             "Service": "systemctl status hosting-manager",
         }
 
@@ -108,19 +145,17 @@ class Deployer:
 
         commands = [
             "cd /opt/hosting-manager",
-            "git fetch origin",
-            "git reset --hard HEAD",  # Discard local changes
-            "git pull origin main",
+            "git fetch --depth 1 --no-tags origin main",  # Tip only, keeps clone shallow
+            "git reset --hard FETCH_HEAD",  # Discard local changes
+            "git gc --auto --quiet",  # Fold the packs left by shallow fetches
         ]
 
-        result = run_ssh(self.server, self.user, " && ".join(commands))
+        result = run_ssh(self.server, self.user, " && ".join(commands), stream=True)
 
         if result.returncode == 0:
             print_success("Code updated")
-            if result.stdout:
-                print(f"  {result.stdout.strip()}")
         else:
-            raise Exception(f"Git pull failed: {result.stderr}")
+            raise Exception("Git pull failed (see output above)")
 
     def install_dependencies(self):
         """Install/update dependencies"""
@@ -129,13 +164,17 @@ class Deployer:
         result = run_ssh(
             self.server,
             self.user,
-            "cd /opt/hosting-manager && sudo pip3 install --break-system-packages -r requirements.txt 2>&1 | grep -v WARNING",
+            "cd /opt/hosting-manager && sudo PIP_CACHE_DIR=/var/cache/pip "
+            "PIP_DISABLE_PIP_VERSION_CHECK=1 PIP_NO_INPUT=1 "
+            "PIP_ROOT_USER_ACTION=ignore pip3 install -q --break-system-packages "
+            "--prefer-binary -c constraints.txt -r requirements.txt",
+            stream=True,
         )
 
         if result.returncode == 0:
             print_success("Dependencies installed")
         else:
-            print_warning(f"Dependency warning: {result.stderr}")
+            print_warning("Dependency warning (see output above)")
 
     def backup_state(self):
         """Backup current state before restart"""
@@ -166,13 +205,23 @@ class Deployer:
             self.server, self.user, "sudo systemctl restart hosting-manager"
         )
 
-        time.sleep(3)
-
         if result.returncode == 0:
             print_success("Service restarted")
         else:
             raise Exception("Failed to restart service")
 
+        # Poll the health endpoint on the server instead of a fixed sleep
+        result = run_ssh(
+            self.server,
+            self.user,
+            f"for i in $(seq {HEALTH_POLL_ATTEMPTS}); do "
+            "curl -sf http://localhost:5000/api/health >/dev/null && exit 0; "
+            f"sleep {HEALTH_POLL_INTERVAL}; done; exit 1",
+        )
+
+        if result.returncode != 0:
+            print_warning("API not responding yet (continuing to verification)")
+
     def verify_deployment(self):
         """Verify deployment is working"""
         print_step("Verifying deployment...")